@@ -1,32 +1,42 @@
-import pandas as pd
 import argparse
+import csv
 
 
 def latex_table(csv_file, output_file):
     """Generate a LaTeX table from a csv file with heading."""
     # Load CSV with first row as column names, first column as row labels
-    df = pd.read_csv(csv_file, index_col=0)
+    with open(csv_file, newline="") as f:
+        rows = list(csv.reader(f))
+    header, body = rows[0], rows[1:]
+    index_name, columns = header[0], header[1:]
 
     # Specify the column to format in scientific notation
     scientific_col = "update time"  # Change this to your column name
-
-    # Convert the chosen column to scientific notation
-    df[scientific_col] = df[scientific_col].apply(lambda x: "{:.2e}".format(x))
-
-    # Convert column names to centered format
-    col_labels = " & ".join([r"\thead{" + col + "}" for col in df.columns])
-
-    # Generate LaTeX table
-    latex_table = df.to_latex(
-        escape=False,  # Allow LaTeX commands
-        column_format="|l|" + "c|" * len(df.columns),  # Ensures proper column alignment
-        float_format="%.3f",  # Specify the number of decimal places
-        index=True,  # Keep the row labels
-        bold_rows=True,  # Makes the row labels bol
+    # Match by prefix so a unit suffix such as "update time (s)" still counts
+    sci_idx = next(
+        (i for i, col in enumerate(columns) if col.startswith(scientific_col)), None
     )
 
-    # Replace default column names with centered headers
-    latex_table = latex_table.replace(" & ".join(df.columns), col_labels, 1)
+    def fmt(i, value):
+        if i == sci_idx:
+            return "{:.2e}".format(float(value))
+        return "{:.3f}".format(float(value))
+
+    # Column names are centered, row labels are bold
+    col_labels = " & ".join([r"\thead{" + col + "}" for col in columns])
+    lines = [
+        # Ensures proper column alignment
+        r"\begin{tabular}{" + "|l|" + "c|" * len(columns) + "}",
+        r"\toprule",
+        " & " + col_labels + r" \\",
+        index_name + " & " * len(columns) + r" \\",
+        r"\midrule",
+    ]
+    for row in body:
+        cells = [fmt(i, value) for i, value in enumerate(row[1:])]
+        lines.append(r"\textbf{" + row[0] + "} & " + " & ".join(cells) + r" \\")
+    lines += [r"\bottomrule", r"\end{tabular}"]
+    latex_table = "\n".join(lines) + "\n"
 
     # Save to file
     with open(output_file, "w") as f:
@@ -6,30 +6,41 @@ from matplotlib.animation import FuncAnimation
 import numpy as np
 import argparse
 
-plt.show(block=True)
-
 parser = argparse.ArgumentParser()
 parser.add_argument("--estimator", help="the estimator you want to use")
+parser.add_argument(
+    "--no-plot",
+    action="store_true",
+    help="only run the estimator and report its error, e.g. for benchmarking",
+)
 
 
-def spin(estimator):
+def spin(estimator, plot=True):
     """
     Parameters
     ----------
     estimator : Estimator
         The instance of the estimator
+    plot : bool
+        Whether to animate the estimate once it has been computed
 
     Returns
     -------
         None
     """
 
-    # noinspection PyUnusedLocal
     estimator.run()
+    if not plot:
+        return
+    # noinspection PyUnusedLocal
     anim = FuncAnimation(
         estimator.fig,
         estimator.plot_update,
+        frames=estimator.x_hat.shape[0],
         init_func=estimator.plot_init,
+        interval=1000 * estimator.dt,  # play back in real time
+        repeat=False,
+        blit=True,
         cache_frame_data=False,
     )
     plt.show(block=True)
@@ -57,7 +68,7 @@ def main():
     else:
         raise RuntimeError("Estimator type {} not supported".format(estimator_type))
     print("Invoking estimator {}...".format(estimator_type))
-    spin(estimator)
+    spin(estimator, plot=not args.no_plot)
     print("Average Update Time: {:}".format(estimator.calc_avg_update_time()))
     error_str = ""
     for e in estimator.calc_error():
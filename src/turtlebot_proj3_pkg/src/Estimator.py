@@ -1,11 +1,33 @@
+import math
 import rospy
+from rospy.numpy_msg import numpy_msg
+import threading
+import time
 from std_msgs.msg import Float32MultiArray
 import matplotlib.pyplot as plt
 import numpy as np
+from numba import njit
 
 plt.rcParams["font.family"] = ["FreeSans", "Helvetica", "Arial"]
 plt.rcParams["font.size"] = 14
 
+# columns of x plotted as the horizontal and vertical coordinates on each Axis
+_PLOT_COLS = {
+    "xy": (2, 3),
+    "phi": (0, 1),
+    "x": (0, 2),
+    "y": (0, 3),
+    "thl": (0, 4),
+    "thr": (0, 5),
+}
+
+
+def _grow(buf, n):
+    """Return buf, doubled in length if row n does not fit in it."""
+    if n == buf.shape[0]:
+        buf = np.resize(buf, (2 * n, *buf.shape[1:]))
+    return buf
+
 
 class Estimator:
     """A base class to represent an estimator.
@@ -21,30 +43,30 @@ class Estimator:
             Half of the track width (m) of TurtleBot3 Burger.
         r : float
             Wheel radius (m) of the TurtleBot3 Burger.
-        u : list
-            A list of system inputs, where, for the ith data point u[i],
+        u : ndarray
+            An (N, 3) array of system inputs, where, for the ith data point u[i],
             u[i][0] is timestamp (s),
             u[i][1] is left wheel rotational speed (rad/s), and
             u[i][2] is right wheel rotational speed (rad/s).
-        x : list
-            A list of system states, where, for the ith data point x[i],
+        x : ndarray
+            An (N, 6) array of system states, where, for the ith data point x[i],
             x[i][0] is timestamp (s),
             x[i][1] is bearing (rad),
             x[i][2] is translational position in x (m),
             x[i][3] is translational position in y (m),
             x[i][4] is left wheel rotational position (rad), and
             x[i][5] is right wheel rotational position (rad).
-        y : list
-            A list of system outputs, where, for the ith data point y[i],
+        y : ndarray
+            An (N, 3) array of system outputs, where, for the ith data point y[i],
             y[i][0] is timestamp (s),
             y[i][1] is translational position in x (m) when freeze_bearing:=true,
             y[i][1] is distance to the landmark (m) when freeze_bearing:=false,
             y[i][2] is translational position in y (m) when freeze_bearing:=true, and
             y[i][2] is relative bearing (rad) w.r.t. the landmark when
             freeze_bearing:=false.
-        x_hat : list
-            A list of estimated system states. It should follow the same format
-            as x.
+        x_hat : ndarray
+            An (N, 6) array of estimated system states. It should follow the
+            same format as x.
         dt : float
             Update frequency of the estimator.
         fig : Figure
@@ -57,6 +79,9 @@ class Estimator:
             matplotlib Line object for estimated states.
         canvas_title : str
             Title of the real-time plot, which is chosen to be estimator type.
+        plot_enabled : bool
+            Whether to plot in real time, from the private ~plot parameter. If
+            not, fig and axd are None and no lines are created.
         sub_u : rospy.Subscriber
             ROS subscriber for system inputs.
         sub_x : rospy.Subscriber
@@ -75,48 +100,143 @@ class Estimator:
     def __init__(self):
         self.d = 0.08
         self.r = 0.033
-        self.u = []
-        self.x = []
-        self.y = []
-        self.x_hat = []  # Your estimates go here!
-        self.update_times = []
+        # u, x, y and x_hat are views of the first _u_n, _x_n, ... rows of
+        # these buffers, which double in length whenever they fill up
+        self._u_buf = np.empty((1024, 3))
+        self._u_n = 0
+        self._x_buf = np.empty((1024, 6))
+        self._x_n = 0
+        self._y_buf = np.empty((1024, 3))
+        self._y_n = 0
+        # views of the latest rows of u, x, y and x_hat; they stay valid when
+        # a buffer is reallocated
+        self._u_last = self._x_last = self._y_last = self._x_hat_last = None
+        # held by the ROS threads while they reallocate _x_buf or _x_hat_buf or
+        # bump their counts, so that the plot sees each buffer with its count
+        self._buf_lock = threading.Lock()
+        self._x_hat_buf = np.empty((1024, 6))  # Your estimates go here!
+        self._x_hat_n = 0
+        # durations (ns) of the timed updates, the first _ut_n entries of _ut
+        self._ut = np.empty(1024, dtype=np.int64)
+        self._ut_n = 0
         self.dt = 0.1
-        self.fig, self.axd = plt.subplot_mosaic(
-            [["xy", "phi"], ["xy", "x"], ["xy", "y"], ["xy", "thl"], ["xy", "thr"]],
-            figsize=(20.0, 10.0),
-        )
-        (self.ln_xy,) = self.axd["xy"].plot([], "o-g", linewidth=2, label="True")
-        (self.ln_xy_hat,) = self.axd["xy"].plot([], "o-c", label="Estimated")
-        (self.ln_phi,) = self.axd["phi"].plot([], "o-g", linewidth=2, label="True")
-        (self.ln_phi_hat,) = self.axd["phi"].plot([], "o-c", label="Estimated")
-        (self.ln_x,) = self.axd["x"].plot([], "o-g", linewidth=2, label="True")
-        (self.ln_x_hat,) = self.axd["x"].plot([], "o-c", label="Estimated")
-        (self.ln_y,) = self.axd["y"].plot([], "o-g", linewidth=2, label="True")
-        (self.ln_y_hat,) = self.axd["y"].plot([], "o-c", label="Estimated")
-        (self.ln_thl,) = self.axd["thl"].plot([], "o-g", linewidth=2, label="True")
-        (self.ln_thl_hat,) = self.axd["thl"].plot([], "o-c", label="Estimated")
-        (self.ln_thr,) = self.axd["thr"].plot([], "o-g", linewidth=2, label="True")
-        (self.ln_thr_hat,) = self.axd["thr"].plot([], "o-c", label="Estimated")
+        # the figure is only built when plotting, ~plot:=false runs headless
+        self.plot_enabled = rospy.get_param("~plot", True)
+        if self.plot_enabled:
+            self.fig, self.axd = plt.subplot_mosaic(
+                [["xy", "phi"], ["xy", "x"], ["xy", "y"], ["xy", "thl"], ["xy", "thr"]],
+                figsize=(20.0, 10.0),
+            )
+            (self.ln_xy,) = self.axd["xy"].plot([], "o-g", linewidth=2, label="True")
+            (self.ln_xy_hat,) = self.axd["xy"].plot([], "o-c", label="Estimated")
+            (self.ln_phi,) = self.axd["phi"].plot([], "o-g", linewidth=2, label="True")
+            (self.ln_phi_hat,) = self.axd["phi"].plot([], "o-c", label="Estimated")
+            (self.ln_x,) = self.axd["x"].plot([], "o-g", linewidth=2, label="True")
+            (self.ln_x_hat,) = self.axd["x"].plot([], "o-c", label="Estimated")
+            (self.ln_y,) = self.axd["y"].plot([], "o-g", linewidth=2, label="True")
+            (self.ln_y_hat,) = self.axd["y"].plot([], "o-c", label="Estimated")
+            (self.ln_thl,) = self.axd["thl"].plot([], "o-g", linewidth=2, label="True")
+            (self.ln_thl_hat,) = self.axd["thl"].plot([], "o-c", label="Estimated")
+            (self.ln_thr,) = self.axd["thr"].plot([], "o-g", linewidth=2, label="True")
+            (self.ln_thr_hat,) = self.axd["thr"].plot([], "o-c", label="Estimated")
+            # Axis key, true state line and estimated state line of each plot
+            self._lines = (
+                ("xy", self.ln_xy, self.ln_xy_hat),
+                ("phi", self.ln_phi, self.ln_phi_hat),
+                ("x", self.ln_x, self.ln_x_hat),
+                ("y", self.ln_y, self.ln_y_hat),
+                ("thl", self.ln_thl, self.ln_thl_hat),
+                ("thr", self.ln_thr, self.ln_thr_hat),
+            )
+            self._artists = tuple(ln for _, *lns in self._lines for ln in lns)
+        else:
+            self.fig = self.axd = None
+            self._lines = self._artists = ()
+        # lengths of x and x_hat when the lines were last updated
+        self._last_plotted_n = (0, 0)
+        # whether the lines have changed since the axis limits were last fit
+        self._lims_stale = False
         self.canvas_title = "N/A"
-        self.sub_u = rospy.Subscriber("u", Float32MultiArray, self.callback_u)
-        self.sub_x = rospy.Subscriber("x", Float32MultiArray, self.callback_x)
-        self.sub_y = rospy.Subscriber("y", Float32MultiArray, self.callback_y)
+        # numpy_msg deserializes msg.data straight into a float32 ndarray,
+        # which is copied into the buffers without going through a tuple
+        msg_type = numpy_msg(Float32MultiArray)
+        self.sub_u = rospy.Subscriber("u", msg_type, self.callback_u)
+        self.sub_x = rospy.Subscriber("x", msg_type, self.callback_x)
+        self.sub_y = rospy.Subscriber("y", msg_type, self.callback_y)
         self.tmr_update = rospy.Timer(rospy.Duration(self.dt), self.update)
 
     def callback_u(self, msg):
-        self.u.append(msg.data)
+        self._u_buf = _grow(self._u_buf, self._u_n)
+        self._u_buf[self._u_n] = msg.data
+        self._u_last = self._u_buf[self._u_n]
+        self._u_n += 1
 
     def callback_x(self, msg):
-        self.x.append(msg.data)
-        if len(self.x_hat) == 0:
-            self.x_hat.append(msg.data)
+        with self._buf_lock:
+            self._x_buf = _grow(self._x_buf, self._x_n)
+        self._x_buf[self._x_n] = msg.data
+        self._x_last = self._x_buf[self._x_n]
+        with self._buf_lock:
+            self._x_n += 1
+        if self._x_hat_n == 0:
+            self.append_x_hat(msg.data)
 
     def callback_y(self, msg):
-        self.y.append(msg.data)
+        self._y_buf = _grow(self._y_buf, self._y_n)
+        self._y_buf[self._y_n] = msg.data
+        self._y_last = self._y_buf[self._y_n]
+        self._y_n += 1
+
+    @property
+    def u(self):
+        return self._u_buf[: self._u_n]
+
+    @property
+    def x(self):
+        return self._x_buf[: self._x_n]
+
+    @property
+    def y(self):
+        return self._y_buf[: self._y_n]
+
+    @property
+    def x_hat(self):
+        return self._x_hat_buf[: self._x_hat_n]
+
+    @property
+    def update_times(self):
+        return self._ut[: self._ut_n] * 1e-9
+
+    def append_x_hat(self, x_hat):
+        """Append the state estimate x_hat, a row in the format of x."""
+        row = self._x_hat_next()
+        row[:] = x_hat
+        self._push_x_hat(row)
+
+    def _x_hat_next(self):
+        """Return the buffer row for the next estimate, to be filled in place.
+
+        The row only becomes part of x_hat once it is passed to _push_x_hat.
+        """
+        with self._buf_lock:
+            self._x_hat_buf = _grow(self._x_hat_buf, self._x_hat_n)
+        return self._x_hat_buf[self._x_hat_n]
+
+    def _push_x_hat(self, row):
+        """Publish the row returned by _x_hat_next as the latest estimate."""
+        self._x_hat_last = row
+        with self._buf_lock:
+            self._x_hat_n += 1
 
     def update(self, _):
         raise NotImplementedError
 
+    def record_update_time(self, t):
+        """Record the duration t (ns) of an update."""
+        self._ut = _grow(self._ut, self._ut_n)
+        self._ut[self._ut_n] = t
+        self._ut_n += 1
+
     def plot_init(self):
         self.axd["xy"].set_title(self.canvas_title)
         self.axd["xy"].set_xlabel("x (m)")
@@ -135,101 +255,73 @@ class Estimator:
         self.axd["thr"].set_xlabel("Time (s)")
         self.axd["thr"].legend()
         plt.tight_layout()
-
-    def plot_update(self, _):
-        self.plot_xyline(self.ln_xy, self.x)
-        self.plot_xyline(self.ln_xy_hat, self.x_hat)
-        self.plot_philine(self.ln_phi, self.x)
-        self.plot_philine(self.ln_phi_hat, self.x_hat)
-        self.plot_xline(self.ln_x, self.x)
-        self.plot_xline(self.ln_x_hat, self.x_hat)
-        self.plot_yline(self.ln_y, self.x)
-        self.plot_yline(self.ln_y_hat, self.x_hat)
-        self.plot_thlline(self.ln_thl, self.x)
-        self.plot_thlline(self.ln_thl_hat, self.x_hat)
-        self.plot_thrline(self.ln_thr, self.x)
-        self.plot_thrline(self.ln_thr_hat, self.x_hat)
-
-    def plot_xyline(self, ln, data):
-        if len(data):
-            x = [d[2] for d in data]
-            y = [d[3] for d in data]
-            ln.set_data(x, y)
-            self.resize_lim(self.axd["xy"], x, y)
-
-    def plot_philine(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            phi = [d[1] for d in data]
-            ln.set_data(t, phi)
-            self.resize_lim(self.axd["phi"], t, phi)
-
-    def plot_xline(self, ln, data):
+        return self._artists
+
+    def plot_update(self, i):
+        # snapshot the data, then draw without holding up the estimator
+        with self._buf_lock:
+            x, x_hat = self.x, self.x_hat
+        n = (x.shape[0], x_hat.shape[0])
+        fresh = n != self._last_plotted_n
+        if not fresh and not self._lims_stale:
+            return self._artists
+        self._last_plotted_n = n
+        # the axis limits follow the data on a slower cadence than the lines,
+        # and catch up on the first frame without new data so the end of the
+        # trajectory is not left clipped
+        resize = not fresh or i % 10 == 0
+        self._lims_stale = not resize
+        resized = False
+        for key, ln, ln_hat in self._lines:
+            resized |= self.plot_line(ln, key, x, resize)
+            resized |= self.plot_line(ln_hat, key, x_hat, resize)
+        if resized:
+            # blitting only redraws the lines, so the new ticks need a full draw
+            self.fig.canvas.draw()
+        return self._artists
+
+    def plot_line(self, ln, key, data, resize=False):
+        """Plot the _PLOT_COLS[key] columns of data on ln, on the Axis key.
+
+        If resize, the Axis limits are grown to fit; returns whether they were.
+        """
         if len(data):
-            t = [d[0] for d in data]
-            x = [d[2] for d in data]
-            ln.set_data(t, x)
-            self.resize_lim(self.axd["x"], t, x)
-
-    def plot_yline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            y = [d[3] for d in data]
-            ln.set_data(t, y)
-            self.resize_lim(self.axd["y"], t, y)
-
-    def plot_thlline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            thl = [d[4] for d in data]
-            ln.set_data(t, thl)
-            self.resize_lim(self.axd["thl"], t, thl)
-
-    def plot_thrline(self, ln, data):
-        if len(data):
-            t = [d[0] for d in data]
-            thr = [d[5] for d in data]
-            ln.set_data(t, thr)
-            self.resize_lim(self.axd["thr"], t, thr)
+            i, j = _PLOT_COLS[key]
+            ln.set_data(data[:, i], data[:, j])
+            if resize:
+                return self.resize_lim(self.axd[key], data[:, i], data[:, j])
+        return False
 
     # noinspection PyMethodMayBeStatic
     def resize_lim(self, ax, x, y):
+        """Grow the limits of ax to cover x and y; return whether they changed."""
         xlim = ax.get_xlim()
-        ax.set_xlim([min(min(x) * 1.05, xlim[0]), max(max(x) * 1.05, xlim[1])])
         ylim = ax.get_ylim()
-        ax.set_ylim([min(min(y) * 1.05, ylim[0]), max(max(y) * 1.05, ylim[1])])
+        new_xlim = (min(x.min() * 1.05, xlim[0]), max(x.max() * 1.05, xlim[1]))
+        new_ylim = (min(y.min() * 1.05, ylim[0]), max(y.max() * 1.05, ylim[1]))
+        if new_xlim == xlim and new_ylim == ylim:
+            return False
+        ax.set_xlim(new_xlim)
+        ax.set_ylim(new_ylim)
+        return True
 
     def calc_avg_update_time(self):
         """Calculate the average update time."""
-        return np.mean(np.array(self.update_times))
+        return self._ut[: self._ut_n].mean() * 1e-9
 
     def calc_error(self):
         """Calculate the RMSE between the estimated and true states."""
-        estimated_states = np.array(self.x_hat)
-        actual_states = np.array(self.x)
-        if estimated_states.shape[0] > actual_states.shape[0]:
-            estimated_states = estimated_states[: actual_states.shape[0]]
-        estimated_states = np.array(
-            [
-                np.arctan2(
-                    np.sin(estimated_states[:, 1]), np.cos(estimated_states[:, 1])
-                ),
-                estimated_states[:, 2],
-                estimated_states[:, 3],
-                estimated_states[:, 4],
-                estimated_states[:, 5],
-            ]
+        actual_states = self.x
+        estimated_states = self.x_hat[: actual_states.shape[0]]
+        # columns 1 to 5, with the bearings wrapped to (-pi, pi] before they
+        # are compared
+        diff = estimated_states[:, 1:] - actual_states[:, 1:]
+        phi_hat = estimated_states[:, 1]
+        phi = actual_states[:, 1]
+        diff[:, 0] = np.arctan2(np.sin(phi_hat), np.cos(phi_hat)) - np.arctan2(
+            np.sin(phi), np.cos(phi)
         )
-        actual_states = np.array(
-            [
-                np.arctan2(np.sin(actual_states[:, 1]), np.cos(actual_states[:, 1])),
-                actual_states[:, 2],
-                actual_states[:, 3],
-                actual_states[:, 4],
-                actual_states[:, 5],
-            ]
-        )
-        return np.linalg.norm(estimated_states - actual_states, axis=1)
+        return np.linalg.norm(diff, axis=0)
 
 
 class OracleObserver(Estimator):
@@ -252,7 +344,8 @@ class OracleObserver(Estimator):
         self.canvas_title = "Oracle Observer"
 
     def update(self, _):
-        self.x_hat.append(self.x[-1])
+        if self._x_n:
+            self.append_x_hat(self._x_last)
 
 
 class DeadReckoning(Estimator):
@@ -280,34 +373,69 @@ class DeadReckoning(Estimator):
     def __init__(self):
         super().__init__()
         self.canvas_title = "Dead Reckoning"
-
-        def f(x, u):
-            matrix = np.array(
-                [
-                    [-self.r / (2 * self.d), self.r / (2 * self.d)],
-                    [(self.r / 2) * np.cos(x[1]), (self.r / 2) * np.cos(x[1])],
-                    [(self.r / 2) * np.sin(x[1]), (self.r / 2) * np.sin(x[1])],
-                    [1, 0],
-                    [0, 1],
-                ]
-            )
-            u_vector = np.array([u[1], u[2]]).reshape((2, 1))
-            result = matrix @ u_vector
-            return result.reshape(-1)  # flatten the result to a 1D array
-
-        self.model = lambda x, u: tuple((np.array(x)[1:] + f(x, u) * self.dt).tolist())
+        # f(x, u) = M u, where only the bearing-dependent rows 1 and 2 of M
+        # change between calls
+        self._M = np.zeros((5, 2))
+        self._M[0] = [-self.r / (2 * self.d), self.r / (2 * self.d)]
+        self._M[3, 0] = self._M[4, 1] = 1
+        self._u = np.empty(2)
+
+    def f(self, x, u):
+        """Unicycle dynamics, with x and u including their timestamps"""
+        self._M[1] = 0.5 * self.r * math.cos(x[1])
+        self._M[2] = 0.5 * self.r * math.sin(x[1])
+        self._u[0] = u[1]
+        self._u[1] = u[2]
+        return self._M @ self._u
+
+    def model(self, x, u):
+        """State after one step of dt from x under u, without its timestamp"""
+        return x[1:] + self.f(x, u) * self.dt
 
     def update(self, _):
-        if len(self.x_hat) > 0 and self.x_hat[-1][0] < self.x[-1][0]:
-            start_time = rospy.get_time()
-            x_hat_next = (
-                self.x_hat[-1][0] + self.dt,  # timestamp
-                *self.model(
-                    self.x_hat[-1], self.u[-1]
-                ),  # unpack the tuple returned by the model
-            )
-            self.x_hat.append(x_hat_next)
-            self.update_times.append(rospy.get_time() - start_time)
+        if self._x_hat_n and self._x_hat_last[0] < self._x_last[0]:
+            start_time = time.perf_counter_ns()
+            x_hat = self._x_hat_next()
+            x_hat_prev = self._x_hat_last
+            x_hat[0] = x_hat_prev[0] + self.dt  # timestamp
+            x_hat[1:] = self.model(x_hat_prev, self._u_last)
+            self._push_x_hat(x_hat)
+            self.record_update_time(time.perf_counter_ns() - start_time)
+
+
+@njit(cache=True)
+def _inv2(S):
+    """Inverse of the 2x2 matrix S, in closed form"""
+    inv_det = 1.0 / (S[0, 0] * S[1, 1] - S[0, 1] * S[1, 0])
+    S_inv = np.empty((2, 2))
+    S_inv[0, 0] = S[1, 1] * inv_det
+    S_inv[0, 1] = -S[0, 1] * inv_det
+    S_inv[1, 0] = -S[1, 0] * inv_det
+    S_inv[1, 1] = S[0, 0] * inv_det
+    return S_inv
+
+
+@njit(cache=True)
+def _kf_step(x_hat_prev, x_hat, u, y, P, A, B, C, CT, Q, R, I):
+    """One predict/update cycle of the linear Kalman filter.
+
+    The new state estimate is written into x_hat and the new error
+    covariance is returned. CT is a contiguous copy of C.T and I is the
+    identity matrix of the size of P.
+    """
+    # state extrapolation
+    x_pred = A @ x_hat_prev + B @ u
+    # covariance extrapolation
+    P_pred = A @ P @ A.T + Q
+    # Kalman gain, the innovation covariance being 2x2
+    PCT = P_pred @ CT
+    K = PCT @ _inv2(C @ PCT + R)
+    # state update
+    x_hat[:] = x_pred + K @ (y - C @ x_pred)
+    # covariance update, in the Joseph form that keeps P symmetric positive
+    # definite
+    IKC = I - K @ C
+    return IKC @ P_pred @ IKC.T + K @ R @ K.T
 
 
 class KalmanFilter(Estimator):
@@ -336,62 +464,137 @@ class KalmanFilter(Estimator):
     def __init__(self):
         super().__init__()
         self.canvas_title = "Kalman Filter"
-        self.phid = np.pi / 4
+        self.phid = math.pi / 4
+        # Every matrix is built fresh from float literals, so it is already
+        # the C-contiguous float64 layout _kf_step is compiled for; only the
+        # transposed view of C needs an explicit copy.
         self.A = np.eye(4)
-        self.B = (
-            np.array(
-                [
-                    [self.r / 2 * np.cos(self.phid), self.r / 2 * np.cos(self.phid)],
-                    [self.r / 2 * np.sin(self.phid), self.r / 2 * np.sin(self.phid)],
-                    [1, 0],
-                    [0, 1],
-                ]
-            )
-            * self.dt
-        )
-        self.C = np.array([[1, 0, 0, 0], [0, 1, 0, 0]])
+        c = self.r / 2 * math.cos(self.phid)
+        s = self.r / 2 * math.sin(self.phid)
+        self.B = np.array([[c, c], [s, s], [1.0, 0.0], [0.0, 1.0]]) * self.dt
+        self.C = np.array([[1.0, 0, 0, 0], [0, 1, 0, 0]])
+        self._CT = self.C.T.copy()
         # TODO: search for combo of covariance matrices producing accurate estimation
         self.Q = np.eye(4)  # covariance matrix of process noise
-        self.R = np.diag([1, 1])  # covariance matrix of measurement noise
-        self.P = np.diag([1, 1, 1, 1])  # covariance matrix of estimation error
+        self.R = np.diag([1.0, 1.0])  # covariance matrix of measurement noise
+        self.P = np.diag([1.0, 1.0, 1.0, 1.0])  # covariance matrix of estimation error
+        self._I = np.eye(4)
+        # Compile _kf_step now (or load it from the on-disk cache) so the
+        # first update is not charged for the JIT.
+        _kf_step(
+            np.zeros(4),
+            np.zeros(4),
+            np.zeros(2),
+            np.zeros(2),
+            self.P,
+            self.A,
+            self.B,
+            self.C,
+            self._CT,
+            self.Q,
+            self.R,
+            self._I,
+        )
 
     # noinspection DuplicatedCode
     # noinspection PyPep8Naming
     def update(self, _):
-        if len(self.x_hat) > 0 and self.x_hat[-1][0] < self.x[-1][0]:
-            start_time = rospy.get_time()
-            # state extrapolation
-            x_hat_prev = np.array(self.x_hat[-1])[2:].reshape(
-                (4, 1)
-            )  # exclude timestamp
-            u_prev = np.array(self.u[-1])[1:].reshape((2, 1))  # exclude timestamp
-            x_pred = self.A @ x_hat_prev + self.B @ u_prev
-            # covariance extrapolation
-            P_pred = self.A @ self.P @ self.A.T + self.Q
-            # Kalman gain
-            K = P_pred @ self.C.T @ np.linalg.inv(self.C @ P_pred @ self.C.T + self.R)
-            # state update
-            self.x_hat.append(
-                (
-                    self.x_hat[-1][0] + self.dt,  # timestamp
-                    self.phid,  # fixed bearing
-                    *tuple(
-                        (
-                            x_pred
-                            + K
-                            @ (
-                                np.array(self.y[-1])[1:].reshape((2, 1))
-                                - self.C @ x_pred
-                            )
-                        )
-                        .flatten()
-                        .tolist()
-                    ),  # unpack the tuple returned by the model
-                )
+        if self._x_hat_n and self._x_hat_last[0] < self._x_last[0]:
+            start_time = time.perf_counter_ns()
+            x_hat = self._x_hat_next()
+            x_hat_prev = self._x_hat_last
+            x_hat[0] = x_hat_prev[0] + self.dt  # timestamp
+            x_hat[1] = self.phid  # fixed bearing
+            self.P = _kf_step(
+                x_hat_prev[2:],  # exclude timestamp and bearing
+                x_hat[2:],
+                self._u_last[1:],  # exclude timestamp
+                self._y_last[1:],  # exclude timestamp
+                self.P,
+                self.A,
+                self.B,
+                self.C,
+                self._CT,
+                self.Q,
+                self.R,
+                self._I,
             )
-            # covariance update
-            self.P = (np.eye(self.P.shape[0]) - K @ self.C) @ P_pred
-            self.update_times.append(rospy.get_time() - start_time)
+            self._push_x_hat(x_hat)
+            self.record_update_time(time.perf_counter_ns() - start_time)
+
+
+@njit(cache=True)
+def _g(x, u, s, c, hrd, rdd, dt, x_next):
+    """Unicycle model of the turtlebot, g(x, u), with x and u without timestamps
+
+    s, c = sin(x[0]), cos(x[0]), and hrd and rdd are r / 2 * dt and
+    r / (2 d) * dt. The propagated state is written into x_next.
+    """
+    x_next[0] = x[0] + rdd * (u[1] - u[0])
+    x_next[1] = x[1] + hrd * c * (u[0] + u[1])
+    x_next[2] = x[2] + hrd * s * (u[0] + u[1])
+    x_next[3] = x[3] + u[0] * dt
+    x_next[4] = x[4] + u[1] * dt
+
+
+@njit(cache=True)
+def _approx_A(u, s, c, hrd, A_bar):
+    """Jacobian of g(x, u) w.r.t. x, with s, c and hrd as in _g
+
+    Only the two bearing-dependent entries are written; the rest of A_bar
+    must already hold the identity.
+    """
+    A_bar[1, 0] = -hrd * s * (u[0] + u[1])
+    A_bar[2, 0] = hrd * c * (u[0] + u[1])
+
+
+@njit(cache=True)
+def _h_and_C(x, lx, ly, y, C_bar):
+    """Measurement model of the turtlebot and its Jacobian at x
+
+    The measurement is the distance to the landmark at (lx, ly) and the
+    bearing. The prediction is written into y and the Jacobian into C_bar,
+    whose other entries are expected to be zero.
+    """
+    dx = x[1] - lx
+    dy = x[2] - ly
+    dist = math.hypot(dx, dy)
+    y[0] = dist
+    y[1] = x[0]
+    C_bar[0, 1] = dx / dist
+    C_bar[0, 2] = dy / dist
+    C_bar[1, 0] = 1
+
+
+@njit(cache=True)
+def _ekf_step(x_hat_prev, x_hat, u, y, P, Q, R, hrd, rdd, dt, lx, ly, I, work):
+    """One predict/update cycle of the unicycle EKF.
+
+    The new state estimate is written into x_hat and the new error
+    covariance is returned. hrd and rdd are the model constants of _g, I is
+    the 5x5 identity and work holds the buffers for x_pred, y_pred, A and C,
+    see ExtendedKalmanFilter.__init__.
+    """
+    x_pred, y_pred, A, C = work
+    # g and its Jacobian are evaluated at the same bearing
+    s = math.sin(x_hat_prev[0])
+    c = math.cos(x_hat_prev[0])
+    # state extrapolation
+    _g(x_hat_prev, u, s, c, hrd, rdd, dt, x_pred)
+    # dynamics linearization
+    _approx_A(u, s, c, hrd, A)
+    # covariance extrapolation
+    P_pred = A @ P @ A.T + Q
+    # measurement prediction and linearization
+    _h_and_C(x_pred, lx, ly, y_pred, C)
+    # Kalman gain, the innovation covariance being 2x2
+    K = P_pred @ C.T @ _inv2(C @ P_pred @ C.T + R)
+    # state update
+    x_hat[:] = x_pred + K @ (y - y_pred)
+    # covariance update, in the Joseph form that keeps P symmetric positive
+    # definite
+    IKC = I - K @ C
+    return IKC @ P_pred @ IKC.T + K @ R @ K.T
 
 
 # noinspection PyPep8Naming
@@ -427,134 +630,65 @@ class ExtendedKalmanFilter(Estimator):
         super().__init__()
         self.canvas_title = "Extended Kalman Filter"
         self.landmark = (0.5, 0.5)  # l_x, l_y for measurement (h())
-        # You may define the Q, R, and P matrices below.
-        self.A = np.eye(5)
+        # You may define the Q, R, and P matrices below. Use float literals so
+        # they are C-contiguous float64, the layout _ekf_step is compiled for.
 
         # TODO: search for combo of covariance matrices producing accurate estimation
-        self.Q = np.diag([3, 0.7, 2, 1, 1])  # covariance matrix of process noise
-        self.R = np.diag([7, 1])  # covariance matrix of measurement noise
+        self.Q = np.diag(
+            [3.0, 0.7, 2.0, 1.0, 1.0]
+        )  # covariance matrix of process noise
+        self.R = np.diag([7.0, 1.0])  # covariance matrix of measurement noise
         # R_11 is smoothness of landmark
         self.P = np.diag(
             [0.7, 0.3, 0.5, 0.1, 0.1]
         )  # covariance matrix of estimation error
-
-        # functions
-        def f(x, u):
-            matrix = np.array(
-                [
-                    [-self.r / (2 * self.d), self.r / (2 * self.d)],
-                    [(self.r / 2) * np.cos(x[0]), (self.r / 2) * np.cos(x[0])],
-                    [(self.r / 2) * np.sin(x[0]), (self.r / 2) * np.sin(x[0])],
-                    [1, 0],
-                    [0, 1],
-                ]
-            )
-            u_vector = np.array([u[0], u[1]]).reshape((2, 1))
-            result = matrix @ u_vector
-            return result  # flatten the result to a 1D array
-
-        def A_bar(x_star, u_star):
-            A_bar = np.eye(5)  # Jacobian of g(x, u) w.r.t. x
-            A_bar[1, 0] = (
-                -self.r / (2) * np.sin(x_star[0]) * (u_star[0] + u_star[1]) * self.dt
-            )
-            A_bar[2, 0] = (
-                self.r / (2) * np.cos(x_star[0]) * (u_star[0] + u_star[1]) * self.dt
-            )
-            return A_bar
-
-        def B_bar(x_star, u_star):
-            return (
-                np.array(
-                    [
-                        [-self.r / (2 * self.d), self.r / (2 * self.d)],
-                        [
-                            (self.r / 2) * np.cos(x_star[0]),
-                            (self.r / 2) * np.cos(x_star[0]),
-                        ],
-                        [
-                            (self.r / 2) * np.sin(x_star[0]),
-                            (self.r / 2) * np.sin(x_star[0]),
-                        ],
-                        [1, 0],
-                        [0, 1],
-                    ]
-                ).T
-                * self.dt
-            )  # Jacobian of g(x, u) w.r.t. u
-
-        self.A_bar = lambda x, u: A_bar(x, u)
-        self.B_bar = lambda x, u: B_bar(x, u)
-        self.model = (
-            lambda x, u: np.array(x).reshape((-1, 1)) + f(x, u) * self.dt
-        )  # g(x, u)
-
-        def h(x):
-            # measurement function h(x) ~ returns the distance to the landmark
-            return np.array(
-                [
-                    np.sqrt(
-                        (self.landmark[0] - x[1]) ** 2 + (self.landmark[1] - x[2]) ** 2
-                    ),  # distance to landmark
-                    x[0],  # relative bearing
-                ]
-            ).reshape((-1, 1))
-
-        self.h = lambda x: h(x)
+        # Loop-invariant factors r / 2 * dt and r / (2 d) * dt of g and A
+        self._hrd = 0.5 * self.r * self.dt
+        self._rdd = self.r / (2 * self.d) * self.dt
+        self._I = np.eye(5)
+        # Buffers reused by every _ekf_step: x_pred, y_pred, A and C
+        self._work = (np.empty(5), np.empty(2), np.eye(5), np.zeros((2, 5)))
+        # Compile _ekf_step now (or load it from the on-disk cache) so the
+        # first update is not charged for the JIT.
+        _ekf_step(
+            np.zeros(5),
+            np.zeros(5),
+            np.zeros(2),
+            np.zeros(2),
+            self.P,
+            self.Q,
+            self.R,
+            self._hrd,
+            self._rdd,
+            self.dt,
+            *self.landmark,
+            self._I,
+            self._work,
+        )
 
     # noinspection DuplicatedCode
     def update(self, _):
-        if len(self.x_hat) > 0 and self.x_hat[-1][0] < self.x[-1][0]:
-            start_time = rospy.get_time()
+        if self._x_hat_n and self._x_hat_last[0] < self._x_last[0]:
+            start_time = time.perf_counter_ns()
             # TODO: Your implementation goes here!
             # You may use self.u, self.y, and self.x[0] for estimation
-            # state extrapolation
-            x_hat_prev = np.array(self.x_hat[-1])[1:]  # exclude timestamp ~ x-hat[t]
-            u_prev = np.array(self.u[-1])[1:]  # exclude timestamp ~u[t]
-            x_pred = self.model(x_hat_prev, u_prev)  # calculate g(x_hat, u)
-
-            # dynamics linearization ~ calculate A[t+1]
-            self.A = self.A_bar(x_hat_prev, u_prev)  # Jacobian of g(x, u) w.r.t. x
-
-            # covariance extrapolation
-            P_pred = self.A @ self.P @ self.A.T + self.Q
-
-            # measurement linearization
-            # calculate C[t+1] ~ Jacobian of h(x) w.r.t. x
-            C_bar = np.zeros((2, 5))
-            C_bar[0, 1] = (x_pred[1] - self.landmark[0]) / np.sqrt(
-                (self.landmark[0] - x_pred[1]) ** 2
-                + (self.landmark[1] - x_pred[2]) ** 2
+            x_hat = self._x_hat_next()
+            x_hat_prev = self._x_hat_last
+            x_hat[0] = x_hat_prev[0] + self.dt  # timestamp
+            self.P = _ekf_step(
+                x_hat_prev[1:],  # exclude timestamp ~ x-hat[t]
+                x_hat[1:],
+                self._u_last[1:],  # exclude timestamp
+                self._y_last[1:],  # exclude timestamp
+                self.P,
+                self.Q,
+                self.R,
+                self._hrd,
+                self._rdd,
+                self.dt,
+                *self.landmark,
+                self._I,
+                self._work,
             )
-            C_bar[0, 2] = (x_pred[2] - self.landmark[1]) / np.sqrt(
-                (self.landmark[0] - x_pred[1]) ** 2
-                + (self.landmark[1] - x_pred[2]) ** 2
-            )
-            C_bar[1, 0] = 1
-            self.C = C_bar
-
-            # Kalman gain
-            K = P_pred @ self.C.T @ np.linalg.inv(self.C @ P_pred @ self.C.T + self.R)
-
-            # state update
-            self.x_hat.append(
-                (
-                    self.x_hat[-1][0] + self.dt,  # timestamp
-                    *tuple(
-                        (
-                            x_pred
-                            + K
-                            @ (
-                                np.array(self.y[-1])[1:].reshape((2, 1))
-                                - self.h(x_pred)
-                            )
-                        )
-                        .flatten()
-                        .tolist()
-                    ),  # unpack the tuple returned by the model
-                )
-            )
-
-            # covariance update
-            self.P = (np.eye(self.P.shape[0]) - K @ self.C) @ P_pred
-            self.update_times.append(rospy.get_time() - start_time)
+            self._push_x_hat(x_hat)
+            self.record_update_time(time.perf_counter_ns() - start_time)
@@ -1,18 +1,17 @@
 #!/usr/bin/env python3
+import math
 import rospy
 from Estimator import OracleObserver, DeadReckoning, KalmanFilter, ExtendedKalmanFilter
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
-import numpy as np
-
-plt.show(block=True)
 
 
 def spin(estimator):
     """Custom function to replace rospy.spin().
 
     Keep the ROS process alive while doing real-time plotting. The default
-    rospy.spin() will break the real-time plotting function.
+    rospy.spin() will break the real-time plotting function, so it is only
+    used when the estimator runs without plotting.
 
     Parameters
     ----------
@@ -23,11 +22,16 @@ def spin(estimator):
     -------
         None
     """
+    if not estimator.plot_enabled:
+        rospy.spin()
+        return
     # noinspection PyUnusedLocal
     anim = FuncAnimation(
         estimator.fig,
         estimator.plot_update,
         init_func=estimator.plot_init,
+        interval=200,  # redraw at 5 Hz, decoupled from the 10 Hz update timer
+        blit=True,
         cache_frame_data=False,
     )
     plt.show(block=True)  # This functions the same as rospy.spin()
@@ -57,10 +61,11 @@ def main():
     print("Times: ", len(estimator.update_times))
     print("Trajectory Error: ", len(estimator.x_hat))
     print("Actual Trajectory: ", len(estimator.x))
+    errors = estimator.calc_error()
     error_str = ""
-    for e in estimator.calc_error():
+    for e in errors:
         error_str += str(e) + ","
-    pos_error = np.linalg.norm(estimator.calc_error()[2:4])
+    pos_error = math.hypot(errors[2], errors[3])
     print("Position Error: ", pos_error)
     error_str += str(pos_error)
     error_str += "," + str(estimator.calc_avg_update_time())